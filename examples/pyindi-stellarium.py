@@ -1,7 +1,8 @@
 # A python server for the stellarium planetarium program
 # it implements the stellarium Telescope Control plugin protocol.
-import signal, os, sys, logging, time, calendar, math, traceback
-import socket, select
+import signal, os, sys, logging, time, calendar, traceback
+import itertools, socket, selectors, struct, threading
+from collections import deque
 
 import PyIndi
 
@@ -14,114 +15,152 @@ indiServerConnected = False
 isIndiTelescopeConnected = False
 indiTelescopeRAJNOW = 0.0
 indiTelescopeDECJNOW = 0.0
-indiTelescopeTIMEUTC = ""
-gotoQueue = []
+# TIME_UTC of the telescope, already converted to a unix timestamp
+indiTelescopeTIMESTAMP = None
+# RA/DEC are updated together from the C++ thread: use this lock to read
+# them as a consistent pair from the main thread
+indiTelescopeLock = threading.Lock()
+gotoQueue = deque()
 
 stelport = 10001
+# period (seconds) between two current position messages sent to stellarium
+stelUpdatePeriod = 0.5
 stelSocket = None
-# current stellarium clients
+stelSelector = None
+# current stellarium clients, indexed by socket file descriptor
 stelClients = {}
 
-killed = False
-
-
-def to_be(n, size):
-    b = bytearray(size)
-    i = size - 1
-    while i >= 0:
-        b[i] = n % 256
-        n = n >> 8
-        i -= 1
-    return b
-
-
-def from_be(b):
-    n = 0
-    for i in range(len(b)):
-        n = (n << 8) + b[i]
-    return n
-
-
-def to_le(n, size):
-    b = bytearray(size)
-    i = 0
-    while i < size:
-        b[i] = n % 256
-        n = n >> 8
-        i += 1
-    return b
-
-
-def from_le(b):
-    n = 0
-    for i in range(len(b) - 1, -1, -1):
-        n = (n << 8) + b[i]
-    return n
+# set by the signal handler to stop the main loop
+killed = threading.Event()
+
+# Stellarium Telescope Control messages (little endian):
+# header is LENGTH (uint16), TYPE (uint16)
+# goto (type 0) is header, TIME (uint64), RA (uint32), DEC (int32)
+# current position is a goto message followed by STATUS (int32)
+STEL_MSG_HEADER = struct.Struct("<HH")
+STEL_GOTO_MSG = struct.Struct("<HHQIi")
+STEL_POSITION_MSG = struct.Struct("<HHQIii")
+# maximum number of queued messages given to one sendmsg call (below IOV_MAX)
+STEL_MAX_SEND_MSGS = 64
+# RA (hours) and DEC (degrees) to protocol integer units
+STEL_RA_SCALE = 4294967296.0 / 24.0
+STEL_DEC_SCALE = 4294967296.0 / 360.0
+
+
+# TIME_UTC is YYYY-MM-DDTHH:MM:SS, slice it rather than using strptime
+# returns None if the time is malformed
+def utc_to_timestamp(utc):
+    if len(utc) == 19 and utc[10] == "T":
+        try:
+            return calendar.timegm(
+                (
+                    int(utc[0:4]),
+                    int(utc[5:7]),
+                    int(utc[8:10]),
+                    int(utc[11:13]),
+                    int(utc[14:16]),
+                    int(utc[17:19]),
+                )
+            )
+        except ValueError:
+            pass
+    return None
+
+
+def build_eq_coords_msg(tstamp, rajnow, decjnow, status):
+    if tstamp is None:
+        # Simulator does not send its UTC time, and timestamp are emptied somewhere
+        # also use our own clock for a malformed time rather than sending the epoch
+        tstamp = int(time.time())
+    return STEL_POSITION_MSG.pack(
+        STEL_POSITION_MSG.size,
+        0,
+        tstamp,
+        int(rajnow * STEL_RA_SCALE) & 0xFFFFFFFF,  # 24h wraps to 0h
+        int(decjnow * STEL_DEC_SCALE),
+        status,
+    )
 
 
 # Simple class to keep stellarium socket connections
 class StelClient:
     def __init__(self, sock, clientaddress):
         self.socket = sock
+        self.fd = sock.fileno()
         self.clientaddress = clientaddress
         self.writebuf = bytearray(120)
-        self.readbuf = bytearray(120)
+        self.writemv = memoryview(self.writebuf)
+        self.sendpos = 0
+        # large enough to get many queued goto messages with a single recv
+        self.readbuf = bytearray(65536)
+        self.readmv = memoryview(self.readbuf)
         self.recv = 0
-        self.msgq = []
+        self.msgq = deque()
         self.tosend = 0
+        self.events = selectors.EVENT_READ
+        stelSelector.register(self.socket, self.events, self)
 
     def hasToWrite(self):
         return self.tosend > 0
 
+    def updateEvents(self):
+        # only ask the selector for write readiness while we have pending data
+        events = selectors.EVENT_READ
+        if self.hasToWrite():
+            events |= selectors.EVENT_WRITE
+        if events != self.events:
+            stelSelector.modify(self.socket, events, self)
+            self.events = events
+
     def performRead(self):
-        # logging.info('Socket '+str(self.socket.fileno()) + ' has to read')
-        buf = bytearray(120 - self.recv)
-        nrecv = self.socket.recv_into(buf, 120 - self.recv)
-        # logging.info('Socket '+str(self.socket.fileno()) + 'read: '+str(buf))
+        # logging.info('Socket '+str(self.fd) + ' has to read')
+        nrecv = self.socket.recv_into(
+            self.readmv[self.recv :], len(self.readbuf) - self.recv
+        )
+        # logging.info('Socket '+str(self.fd) + 'read: '+str(nrecv))
         if nrecv <= 0:
-            logging.info("Client " + str(self.socket.fileno()) + " is away")
+            logging.info("Client " + str(self.fd) + " is away")
             self.disconnect()
-            stelClients.pop(self.socket)
+            stelClients.pop(self.fd)
             return
-        self.readbuf[self.recv : self.recv + nrecv] = buf
         self.recv += nrecv
         last = self.datareceived()
+        if last is None:
+            logging.info("Client " + str(self.fd) + " sent an invalid message")
+            self.disconnect()
+            stelClients.pop(self.fd)
+            return
         if last > 0:
-            self.readbuf = self.readbuf[last:]
+            # move the pending partial message to the buffer start
+            self.readmv[: self.recv - last] = self.readmv[last : self.recv]
             self.recv -= last
 
     def datareceived(self):
-        global gotoQueue
         p = 0
-        while p < self.recv - 2:
-            psize = from_le(self.readbuf[p : p + 2])
-            if psize > len(self.readbuf) - p:
+        while p + STEL_MSG_HEADER.size <= self.recv:
+            psize, ptype = STEL_MSG_HEADER.unpack_from(self.readmv, p)
+            if psize < STEL_MSG_HEADER.size:
+                # shorter than its own header, parsing would never advance
+                return None
+            if psize > self.recv - p:
                 break
-            ptype = from_le(self.readbuf[p + 2 : p + 4])
-            if ptype == 0:
-                micros = from_le(self.readbuf[p + 4 : p + 12])
+            if ptype == 0 and psize < STEL_GOTO_MSG.size:
+                logging.warning("Client %d sent a short goto message", self.fd)
+                p += psize
+            elif ptype == 0:
+                _, _, micros, targetraint, targetdecint = STEL_GOTO_MSG.unpack_from(
+                    self.readmv, p
+                )
                 if abs((micros / 1000000.0) - int(time.time())) > 60.0:
                     logging.warning(
-                        "Client "
-                        + str(self.socket.fileno())
-                        + " clock differs for more than one minute: "
-                        + str(int(micros / 1000000.0))
-                        + "/"
-                        + str(int(time.time()))
+                        "Client %d clock differs for more than one minute: %d/%d",
+                        self.fd,
+                        micros // 1000000,
+                        int(time.time()),
                     )
-                targetraint = from_le(self.readbuf[p + 12 : p + 16])
-                targetdecint = from_le(self.readbuf[p + 16 : p + 20])
-                if targetdecint > (4294967296 / 2):
-                    targetdecint = -(4294967296 - targetdecint)
-                targetra = (targetraint * 24.0) / 4294967296.0
-                targetdec = (targetdecint * 360.0) / 4294967296.0
-                logging.info(
-                    "Queuing goto (ra, dec)=("
-                    + str(targetra)
-                    + ", "
-                    + str(targetdec)
-                    + ")"
-                )
+                targetra = targetraint / STEL_RA_SCALE
+                targetdec = targetdecint / STEL_DEC_SCALE
+                logging.info("Queuing goto (ra, dec)=(%s, %s)", targetra, targetdec)
                 gotoQueue.append((targetra, targetdec))
                 p += psize
             else:
@@ -129,48 +168,59 @@ class StelClient:
         return p
 
     def performWrite(self):
-        global stelClients
-        # logging.info('Socket '+str(self.socket.fileno()) + ' will write')
-        sent = self.socket.send(self.writebuf[0 : self.tosend])
+        # logging.info('Socket '+str(self.fd) + ' will write')
+        # send the pending buffer and the queued messages with a single syscall
+        buffers = [self.writemv[self.sendpos : self.sendpos + self.tosend]]
+        buffers.extend(itertools.islice(self.msgq, STEL_MAX_SEND_MSGS))
+        sent = self.socket.sendmsg(buffers)
         if sent <= 0:
-            logging.info("Client " + str(self.socket.fileno()) + " is away")
+            logging.info("Client " + str(self.fd) + " is away")
             self.disconnect()
-            stelClients.pop(self.socket)
+            stelClients.pop(self.fd)
             return
-        self.writebuf = self.writebuf[sent:]
-        self.tosend -= sent
-        if self.tosend == 0:
+        if sent < self.tosend:
+            self.sendpos += sent
+            self.tosend -= sent
+        else:
+            sent -= self.tosend
+            self.sendpos = 0
+            self.tosend = 0
+            while len(self.msgq) > 0 and sent >= len(self.msgq[0]):
+                sent -= len(self.msgq.popleft())
             if len(self.msgq) > 0:
-                self.writebuf[0 : len(self.msgq[0])] = self.msgq[0]
-                self.tosend = len(msgq[0])
-                self.msgq = self.msgq[1:]
+                # keep the unsent part of a partially sent message
+                msg = self.msgq.popleft()
+                self.writemv[0 : len(msg) - sent] = msg[sent:]
+                self.tosend = len(msg) - sent
+        self.updateEvents()
 
     def sendMsg(self, msg):
         if self.tosend == 0:
-            self.writebuf[0 : len(msg)] = msg
-            self.tosend = len(msg)
-        else:
-            self.msgq.append(msg)
-
-    def sendEqCoords(self, utc, rajnow, decjnow, status):
-        msg = bytearray(24)
-        msg[0:2] = to_le(24, 2)
-        msg[2:4] = to_le(0, 2)
-        if utc != "":
+            # nothing pending: try to send it right now, this avoids two
+            # selector updates and a wakeup for each position message
             try:
-                tstamp = calendar.timegm(time.strptime(utc, "%Y-%m-%dT%H:%M:%S"))
-            except:
-                tstamp = 0
+                sent = self.socket.send(msg)
+            except OSError:
+                # would block, or the client is away which the next read reports
+                sent = 0
+            if sent == len(msg):
+                return
+            msg = msg[sent:]
+        # append to the write buffer while there is room after the pending
+        # data, queue the message otherwise
+        tail = self.sendpos + self.tosend
+        if len(self.msgq) == 0 and tail + len(msg) <= len(self.writebuf):
+            self.writemv[tail : tail + len(msg)] = msg
+            self.tosend += len(msg)
+            self.updateEvents()
         else:
-            # Simulator does not send its UTC time, and timestamp are emptied somewhere
-            tstamp = int(time.time())
-        msg[4:12] = to_le(tstamp, 8)
-        msg[12:16] = to_le(int(math.floor(rajnow * (4294967296.0 / 24.0))), 4)
-        msg[16:20] = to_le(int(math.floor(decjnow * (4294967296.0 / (360.0)))), 4)
-        msg[20:24] = to_le(status, 4)
-        self.sendMsg(msg)
+            self.msgq.append(msg)
 
     def disconnect(self):
+        try:
+            stelSelector.unregister(self.socket)
+        except KeyError:
+            pass
         try:
             self.socket.shutdown(socket.SHUT_RDWR)
             self.socket.close()
@@ -190,6 +240,9 @@ class IndiClient(PyIndi.BaseClient):
         self.logger = logging.getLogger("PyIndi.BaseClient")
         self.telescope = telescope
         self.tdevice = None
+        # goto properties of the telescope, see getGotoProperties
+        self.oncoordset = None
+        self.eqeodcoords = None
 
     # These new* and server* virtual methods live in a C++ thread.
     # Beware of their interaction with other python threads: swig locks
@@ -211,23 +264,25 @@ class IndiClient(PyIndi.BaseClient):
                     self.connectDevice(self.telescope)
                 if self.tdevice.isConnected():
                     self.logger.info("Found connected device " + p.getDeviceName())
-                    isIndiTelescopeConnected = True
+                    with indiTelescopeLock:
+                        isIndiTelescopeConnected = True
             if p.getName() == "EQUATORIAL_EOD_COORD":
                 nvp = p.getNumber()
-                indiTelescopeRAJNOW = nvp[0].value
-                indiTelescopeDECJNOW = nvp[1].value
+                with indiTelescopeLock:
+                    indiTelescopeRAJNOW = nvp[0].value
+                    indiTelescopeDECJNOW = nvp[1].value
+                # lazy formatting: nothing is built if INFO is disabled
                 self.logger.info(
-                    "Got JNow Eq. coords for "
-                    + p.getDeviceName()
-                    + ": (ra, dec)=("
-                    + str(indiTelescopeRAJNOW)
-                    + ", "
-                    + str(indiTelescopeDECJNOW)
-                    + ")"
+                    "Got JNow Eq. coords for %s: (ra, dec)=(%s, %s)",
+                    self.telescope,
+                    nvp[0].value,
+                    nvp[1].value,
                 )
 
     def removeProperty(self, p):
-        pass
+        if p.getDeviceName() == self.telescope:
+            self.oncoordset = None
+            self.eqeodcoords = None
 
     def newBLOB(self, bp):
         pass
@@ -237,25 +292,31 @@ class IndiClient(PyIndi.BaseClient):
         # self.logger.info ("new Switch "+ svp.name.decode() + " for device "+ svp.device.decode())
         if svp.device == self.telescope:
             if svp.name == "CONNECTION":
-                if svp[0].s == PyIndi.ISS_ON:
-                    isIndiTelescopeConnected = True
-                if svp[1].s == PyIndi.ISS_ON:
-                    isIndiTelescopeConnected = False
+                with indiTelescopeLock:
+                    if svp[0].s == PyIndi.ISS_ON:
+                        isIndiTelescopeConnected = True
+                    if svp[1].s == PyIndi.ISS_ON:
+                        isIndiTelescopeConnected = False
 
     def newNumber(self, nvp):
         global indiTelescopeRAJNOW, indiTelescopeDECJNOW
         if nvp.device == self.telescope:
             if nvp.name == "EQUATORIAL_EOD_COORD":
-                indiTelescopeRAJNOW = nvp[0].value
-                indiTelescopeDECJNOW = nvp[1].value
+                with indiTelescopeLock:
+                    indiTelescopeRAJNOW = nvp[0].value
+                    indiTelescopeDECJNOW = nvp[1].value
                 # self.logger.info ("RA/DEC Timestamp "+str(nvp.timestamp))
 
     def newText(self, tvp):
-        global indiTelescopeTIMEUTC
+        global indiTelescopeTIMESTAMP
         if tvp.device == self.telescope:
             if tvp.name == "TIME_UTC":
-                indiTelescopeTIMEUTC = tvp[0].text
-                self.logger.info("UTC Time " + str(tvp[0].text))
+                # parse it here once, not for each position message
+                utc = tvp[0].text
+                tstamp = utc_to_timestamp(utc)
+                with indiTelescopeLock:
+                    indiTelescopeTIMESTAMP = tstamp
+                self.logger.info("UTC Time %s", utc)
 
     def newLight(self, lvp):
         pass
@@ -282,19 +343,47 @@ class IndiClient(PyIndi.BaseClient):
             + ")"
         )
         indiServerConnected = False
+        self.oncoordset = None
+        self.eqeodcoords = None
 
     # You may extend the BaseClient class with your own python methods.
     # These ones will live in the main python thread.
+    # Retries with an exponential backoff (0.2s up to 5s), returns False if
+    # we were killed while waiting.
     def waitServer(self):
+        delay = 0.2
         while not self.connectServer():
             self.logger.info(
                 "No indiserver running on " + self.getHost() + ":" + str(self.getPort())
             )
-            time.sleep(5)
+            if killed.wait(delay):
+                return False
+            delay = min(delay * 2, 5.0)
+        return True
+
+    # Looks up the ON_COORD_SET and EQUATORIAL_EOD_COORD properties once and
+    # keeps them until the telescope removes a property or the server is lost.
+    # Returns None when they are not available. The attributes are reset from
+    # the INDI thread, so they are only read once here.
+    def getGotoProperties(self):
+        oncoordset = self.oncoordset
+        eqeodcoords = self.eqeodcoords
+        if oncoordset and eqeodcoords:
+            return oncoordset, eqeodcoords
+        d = self.getDevice(self.telescope)
+        if not (d):
+            return None
+        oncoordset = d.getSwitch("ON_COORD_SET")
+        eqeodcoords = d.getNumber("EQUATORIAL_EOD_COORD")
+        if not (oncoordset) or not (eqeodcoords):
+            return None
+        self.oncoordset = oncoordset
+        self.eqeodcoords = eqeodcoords
+        return oncoordset, eqeodcoords
 
 
 def terminate(signum, frame):
-    killed = True
+    killed.set()
 
 
 # how to get back this signal which is translated in a python exception ?
@@ -310,7 +399,7 @@ indiclient.setServer(indihost, indiport)
 
 # Whereas connection to the indiserver will be handled by the C++ thread and the
 # above callbacks, connection from the stellarium client programs will be managed
-# in the main python thread: we use the usual select method with non-blocking sockets,
+# in the main python thread: we use a selector (epoll on Linux) with non-blocking sockets,
 # listening on the stellarium port (10001) and using buffered reads/writes on the
 # connected stellarium client sockets.
 stelSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -318,14 +407,24 @@ stelSocket.bind(("", stelport))
 stelSocket.listen(5)
 stelSocket.setblocking(0)
 stelSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+stelSelector = selectors.DefaultSelector()
+stelSelector.register(stelSocket, selectors.EVENT_READ)
+# signals are written to this socket pair so that they wake up the selector
+wakeupRecv, wakeupSend = socket.socketpair()
+wakeupRecv.setblocking(0)
+wakeupSend.setblocking(0)
+signal.set_wakeup_fd(wakeupSend.fileno())
+stelSelector.register(wakeupRecv, selectors.EVENT_READ)
 status = 0
+nextCoordsUpdate = 0.0
 try:
-    while not killed:
+    while not killed.is_set():
         # try to reconnect indi server if server restarted
         if not (indiServerConnected):
             # Connect to the indi server restricting new* messages to our telescope device
             indiclient.watchDevice(inditelescope)
-            indiclient.waitServer()
+            if not indiclient.waitServer():
+                break
             logging.info(
                 "Connected to indiserver@"
                 + indiclient.getHost()
@@ -335,67 +434,79 @@ try:
                 + inditelescope
                 + '" device'
             )
-        if isIndiTelescopeConnected:
+        # snapshot the telescope state updated by the INDI client thread
+        with indiTelescopeLock:
+            telescopeConnected = isIndiTelescopeConnected
+            tstamp = indiTelescopeTIMESTAMP
+            rajnow = indiTelescopeRAJNOW
+            decjnow = indiTelescopeDECJNOW
+        if telescopeConnected:
             # logging.info('RA='+str(indiTelescopeRAJNOW)+', DEC='+str(indiTelescopeDECJNOW))
-            for s in stelClients:
-                stelClients[s].sendEqCoords(
-                    indiTelescopeTIMEUTC,
-                    indiTelescopeRAJNOW,
-                    indiTelescopeDECJNOW,
-                    status,
-                )
+            now = time.monotonic()
+            if now >= nextCoordsUpdate:
+                # the same message is sent to every client, build it once
+                msg = build_eq_coords_msg(tstamp, rajnow, decjnow, status)
+                for sc in stelClients.values():
+                    sc.sendMsg(msg)
+                nextCoordsUpdate = now + stelUpdatePeriod
             if len(gotoQueue) > 0:
-                logging.info("Sending goto (ra, dec)=" + str(gotoQueue[0]))
-                d = indiclient.getDevice(inditelescope)
-                oncoordset = d.getSwitch("ON_COORD_SET")
-                oncoordset[0].s = PyIndi.ISS_ON
-                oncoordset[1].s = PyIndi.ISS_OFF
-                oncoordset[2].s = PyIndi.ISS_OFF
-                indiclient.sendNewSwitch(oncoordset)
-                eqeodcoords = d.getNumber("EQUATORIAL_EOD_COORD")
-                eqeodcoords[0].value = gotoQueue[0][0]
-                eqeodcoords[1].value = gotoQueue[0][1]
-                gotoQueue = gotoQueue[1:]
-                indiclient.sendNewNumber(eqeodcoords)
+                goto = gotoQueue.popleft()
+                logging.info("Sending goto (ra, dec)=%s", goto)
+                gotoProperties = indiclient.getGotoProperties()
+                if gotoProperties is None:
+                    logging.info("Goto properties not available, skipping goto")
+                else:
+                    oncoordset, eqeodcoords = gotoProperties
+                    oncoordset[0].s = PyIndi.ISS_ON
+                    oncoordset[1].s = PyIndi.ISS_OFF
+                    oncoordset[2].s = PyIndi.ISS_OFF
+                    indiclient.sendNewSwitch(oncoordset)
+                    eqeodcoords[0].value = goto[0]
+                    eqeodcoords[1].value = goto[1]
+                    indiclient.sendNewNumber(eqeodcoords)
         # logging.info('Perform step')
-        # perform one step
-        readers = [stelSocket] + [s for s in stelClients]
-        writers = [s for s in stelClients if stelClients[s].hasToWrite()]
-        ready_to_read, ready_to_write, in_error = select.select(
-            readers, writers, [], 0.5
-        )
-        for r in ready_to_read:
-            if r == stelSocket:
+        # perform one step, waking up in time for the next position update
+        timeout = stelUpdatePeriod
+        if telescopeConnected:
+            timeout = max(0.0, nextCoordsUpdate - time.monotonic())
+        for key, mask in stelSelector.select(timeout):
+            if key.fileobj is stelSocket:
                 news, newa = stelSocket.accept()
                 news.setblocking(0)
-                stelClients[news] = StelClient(news, newa)
+                # position messages are small and periodic: do not let Nagle
+                # delay them until the next one is queued
+                news.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                stelClients[news.fileno()] = StelClient(news, newa)
                 logging.info(
                     "New Stellarium client "
                     + str(news.fileno())
                     + " on port "
                     + str(newa)
                 )
-            else:
-                stelClients[r].performRead()
-        for r in ready_to_write:
-            if r in stelClients.keys():
-                stelClients[r].performWrite()
-        for r in in_error:
-            logging.info("Lost Stellarium client " + str(r.fileno()))
-            if r in stelClients.keys():
-                stelClients[r].disconnect()
-                stelClients.pop(r)
-        time.sleep(0.5)
+                continue
+            if key.fileobj is wakeupRecv:
+                wakeupRecv.recv(64)
+                continue
+            client = key.data
+            if mask & selectors.EVENT_READ:
+                client.performRead()
+            if mask & selectors.EVENT_WRITE and key.fd in stelClients:
+                client.performWrite()
 except KeyboardInterrupt:
     logging.info("Bye")
-else:
+except:
     traceback.print_exc()
+else:
+    logging.info("Terminated by signal, bye")
 
 stelSocket.shutdown(socket.SHUT_RDWR)
 stelSocket.close()
-for sc in stelClients:
-    stelClients[sc].disconnect()
-stelSocket.close()
+for sc in stelClients.values():
+    sc.disconnect()
+stelSelector.close()
+signal.set_wakeup_fd(-1)
+wakeupRecv.close()
+wakeupSend.close()
 indiclient.disconnectServer()
 
 sys.exit(0)
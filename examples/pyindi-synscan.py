@@ -3,14 +3,14 @@
 
 import logging
 import os
-import sys
 import pty
 import time
 import datetime
-import math
 import struct
 import socket
-import select
+import selectors
+import signal
+import threading
 
 import PyIndi
 
@@ -33,19 +33,21 @@ class IndiClient(PyIndi.BaseClient):
         self.isconnected = False
 
     def newDevice(self, d):
-        pass
+        deviceUpdated.set()
 
     def newProperty(self, p):
-        pass
+        deviceUpdated.set()
 
     def removeProperty(self, p):
-        pass
+        # the cached property view is no longer valid
+        propertyCache.pop(p.getName(), None)
 
     def newBLOB(self, bp):
         pass
 
     def newSwitch(self, svp):
-        pass
+        # CONNECTION switch changes are waited for during startup
+        deviceUpdated.set()
 
     def newNumber(self, nvp):
         # logger.info("New value for number "+ nvp.name)
@@ -58,417 +60,494 @@ class IndiClient(PyIndi.BaseClient):
         pass
 
     def newMessage(self, d, m):
-        logger.info("Message for " + d.getDeviceName() + ":" + d.messageQueue(m))
+        logger.info("Message for %s:%s", d.getDeviceName(), d.messageQueue(m))
 
     def serverConnected(self):
         self.isconnected = True
-        logger.info(
-            "Server connected (" + self.getHost() + ":" + str(self.getPort()) + ")"
-        )
+        logger.info("Server connected (%s:%d)", self.getHost(), self.getPort())
 
     def serverDisconnected(self, code):
         self.isconnected = False
+        propertyCache.clear()
         logger.info(
-            "Server disconnected (exit code = "
-            + str(code)
-            + ","
-            + str(self.getHost())
-            + ":"
-            + str(self.getPort())
-            + ")"
+            "Server disconnected (exit code = %s,%s:%d)",
+            code,
+            self.getHost(),
+            self.getPort(),
         )
 
 
 numberFailures = set()
 switchFailures = set()
 textFailures = set()
-
-
-def getNumberWithRetry(prop, ntry=5, delay=0.2):
-    while ntry > 0:
-        p = device.getNumber(prop)
-        if type(p) == PyIndi.PropertyViewNumber:
-            numberFailures.discard(prop)
+# property views of the telescope device, indexed by property name.
+# These are views on the INDI properties so they are kept up to date by the
+# client library, entries are removed when the device deletes the property.
+propertyCache = {}
+# set by the client callbacks when a device, a property or a switch shows up
+# or changes, so that startup waits for them without polling
+deviceUpdated = threading.Event()
+
+
+def getPropertyWithRetry(kind, viewtype, failures, prop, ntry, delay):
+    p = propertyCache.get(prop)
+    if p is not None:
+        return p
+    # the device method is only looked up on a cache miss
+    getter = getattr(device, "get" + kind.capitalize())
+    # retry for a total of ntry * delay seconds: wakeups are triggered by any
+    # device update so they can't be counted as tries
+    deadline = time.monotonic() + ntry * delay
+    while True:
+        deviceUpdated.clear()
+        p = getter(prop)
+        if type(p) == viewtype:
+            failures.discard(prop)
+            propertyCache[prop] = p
             return p
-        if prop in numberFailures:
+        if prop in failures:
             return None
-        logger.info("Unable to get number property " + prop + ", retrying")
-        ntry -= 1
-        time.sleep(delay)
-    logger.info("Unable to get number property " + prop + ", marking as failed")
-    numberFailures.add(prop)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        logger.info("Unable to get %s property %s, retrying", kind, prop)
+        # woken up as soon as the device defines a new property
+        deviceUpdated.wait(remaining)
+    logger.info("Unable to get %s property %s, marking as failed", kind, prop)
+    failures.add(prop)
     return None
 
 
+def getNumberWithRetry(prop, ntry=5, delay=0.2):
+    return getPropertyWithRetry(
+        "number", PyIndi.PropertyViewNumber, numberFailures, prop, ntry, delay
+    )
+
+
 def getSwitchWithRetry(prop, ntry=5, delay=0.2):
-    while ntry > 0:
-        p = device.getSwitch(prop)
-        if type(p) == PyIndi.PropertyViewSwitch:
-            switchFailures.discard(prop)
-            return p
-        if prop in switchFailures:
-            return None
-        logger.info("Unable to get switch property " + prop + ", retrying")
-        ntry -= 1
-        time.sleep(delay)
-    logger.info("Unable to get switch property " + prop + ", marking as failed")
-    switchFailures.add(prop)
-    return None
+    return getPropertyWithRetry(
+        "switch", PyIndi.PropertyViewSwitch, switchFailures, prop, ntry, delay
+    )
 
 
 def getTextWithRetry(prop, ntry=5, delay=0.2):
-    while ntry > 0:
-        p = device.getText(prop)
-        if type(p) == PyIndi.PropertyViewText:
-            textFailures.discard(prop)
-            return p
-        if prop in textFailures:
-            return None
-        logger.info("Unable to get text property " + prop + ", retrying")
-        ntry -= 1
-        time.sleep(delay)
-    logger.info("Unable to get text property " + prop + ", marking as failed")
-    textFailures.add(prop)
-    return None
+    return getPropertyWithRetry(
+        "text", PyIndi.PropertyViewText, textFailures, prop, ntry, delay
+    )
+
+
+# Default error
+reply_error = b"#"
+# scale factors of the 24 bits RA/DEC precise format
+HOURS_TO_24BITS = 2**24 / 24.0
+DEGREES_TO_24BITS = 2**24 / 360.0
+# and of the 32/16 bits goto/sync formats (exact: the divisors are powers of 2)
+HOURS_PER_32BITS = 24.0 / 2**32
+DEGREES_PER_32BITS = 360.0 / 2**32
+HOURS_PER_16BITS = 24.0 / 2**16
+DEGREES_PER_16BITS = 360.0 / 2**16
+# command bytes tested inside the handlers
+CMD_GET_RADEC_PRECISE = ord("e")
+GOTO_CMDS = frozenset((ord("r"), ord("R")))
+PRECISE_CMDS = frozenset((ord("r"), ord("s")))
+EQ_TRACKING_MODES = frozenset((ord("2"), ord("3")))
+# SynScan slew rate (1-9) -> INDI TELESCOPE_SLEW_RATE switch name
+SLEW_RATE_NAMES = (
+    None,
+    "SLEW_GUIDE",
+    "SLEW_CENTERING",
+    "SLEW_CENTERING",
+    "SLEW_CENTERING",
+    "SLEW_FIND",
+    "SLEW_FIND",
+    "SLEW_FIND",
+    "SLEW_MAX",
+    "SLEW_MAX",
+)
+# h reply: hour, minute, second, month, day, year - 2000, utc offset, dst
+TIME_REPLY = struct.Struct("BBBBBBBBc")
+# w reply: latitude d/m/s, north/south, longitude d/m/s, east/west
+LOCATION_REPLY = struct.Struct("BBBBBBBBc")
+# Model replies
+SKYWATCHER_MODELS = {
+    "EQ6": b"\x00#",
+    "HEQ5": b"\x01#",
+    "EQ5": b"\x02#",
+    "EQ3": b"\x03#",
+    "EQ8": b"\x04#",
+    "AZ-EQ6": b"\x05#",
+    "AZ-EQ5": b"\x06#",
+}
+# Version reply
+# VERSION_REPLY = b"21#"
+# VERSION_REPLY = b"\x04\x0E#"
+# VERSION_REPLY = b"\x03\x03#"
+# nex skywatcher ?
+# VERSION_REPLY = b"042508#"
+VERSION_REPLY = b"032507"
+# celestron / old skywatcher ?
+# VERSION_REPLY = b"\x04\x25\x07"
+# VERSION_REPLY = b"\x04\x25\x07#" normally with a # but this corrupts the indi-synscan driver
+
+# SynScan command handlers: each one gets the command byte, the buffer and the
+# index of the first argument byte. It returns the index of the next command
+# and the reply for this command.
+
+
+# Jump
+def cmd_jump(cmd, buf, i, indiclient, logger):
+    return i, b""
+
+
+def cmd_terminator(cmd, buf, i, indiclient, logger):
+    return i, b"#"
+
+
+# Echo
+def cmd_echo(cmd, buf, i, indiclient, logger):
+    if not (indiclient.isconnected):
+        return i + 1, reply_error
+    return i + 1, buf[i : i + 1] + b"#"
+
+
+# Alignment complete ?
+def cmd_alignment_complete(cmd, buf, i, indiclient, logger):
+    return i, b"\x01#"
+
+
+# Get Ra/Dec
+def cmd_get_radec(cmd, buf, i, indiclient, logger):
+    p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
+    if p is None:
+        return i, reply_error
+    decdeg = p[1].value
+    if decdeg < 0.0:
+        decdeg = 360.0 + decdeg
+    # wrap 24h/360° (reached by rounding) to 0 so that fields keep 6 digits
+    ra = int(p[0].value * HOURS_TO_24BITS) & 0xFFFFFF
+    dec = int(decdeg * DEGREES_TO_24BITS) & 0xFFFFFF
+    if cmd == CMD_GET_RADEC_PRECISE:
+        return i, b"%06X00,%06X00#" % (ra, dec)
+    return i, b"%04X,%04X#" % (ra >> 8, dec >> 8)
+
+
+# Get time
+def cmd_get_time(cmd, buf, i, indiclient, logger):
+    p = getTextWithRetry("TIME_UTC")
+    if p is None:
+        return i, reply_error
+    utc8601 = p[0].text
+    if p[1].text:
+        offset = int(p[1].text)
+    else:
+        offset = 0
+    # TIME_UTC is YYYY-MM-DDTHH:MM:SS, slicing is much faster than strptime
+    utc = datetime.datetime(
+        int(utc8601[0:4]),
+        int(utc8601[5:7]),
+        int(utc8601[8:10]),
+        int(utc8601[11:13]),
+        int(utc8601[14:16]),
+        int(utc8601[17:19]),
+    )
+    utc = utc + datetime.timedelta(hours=offset)
+    return i, TIME_REPLY.pack(
+        utc.hour,
+        utc.minute,
+        utc.second,
+        utc.month,
+        utc.day,
+        utc.year - 2000,
+        offset & 0xFF,  # signed byte
+        0x00,
+        b"#",
+    )
+
+
+# Get Model
+def cmd_get_model(cmd, buf, i, indiclient, logger):
+    p = getTextWithRetry("MOUNTINFORMATION")
+    if p is None:
+        return i, b"!#"
+    return i, SKYWATCHER_MODELS.get(p[0].text, b"\x00#")
+
+
+# Positive angle in degrees to (degrees, minutes, seconds), seconds truncated
+def degrees_to_dms(deg):
+    m, s = divmod(int(deg * 3600), 60)
+    d, m = divmod(m, 60)
+    return d, m, s
+
+
+# Get Location
+def cmd_get_location(cmd, buf, i, indiclient, logger):
+    p = getNumberWithRetry("GEOGRAPHIC_COORD")
+    if p is None:
+        return i, reply_error
+    latdeg = p[0].value
+    longdeg = p[1].value
+    elev = p[2].value
+    latd = 0
+    if latdeg < 0.0:
+        latd = 1
+        latdeg = -(latdeg)
+    longh = 0
+    if longdeg > 180.0:
+        longdeg -= 360.0
+    if longdeg < 0.0:
+        longh = 1
+        longdeg = -(longdeg)
+    return i, LOCATION_REPLY.pack(
+        *degrees_to_dms(latdeg), latd, *degrees_to_dms(longdeg), longh, b"#"
+    )
+
+
+# Get Version
+def cmd_get_version(cmd, buf, i, indiclient, logger):
+    return i, VERSION_REPLY
+
+
+# Set time
+def cmd_set_time(cmd, buf, i, indiclient, logger):
+    [h, m, s, mth, d, y, offset, dst] = buf[i : i + 8]
+    i += 8
+    y += 2000
+    # the utc offset is received as a signed byte
+    if offset > 127:
+        offset -= 256
+    lt = datetime.datetime(y, mth, d, h, m, s, 0, None)
+    utc = lt - datetime.timedelta(hours=offset)
+    logger.info("Setting time to %s %s", utc.isoformat(), offset)
+    p = getTextWithRetry("TIME_UTC")
+    if p is None:
+        return i, reply_error
+    p[0].text = utc.isoformat()
+    p[1].text = str(offset)
+    indiclient.sendNewText(p)
+    return i, b"#"
+
+
+# Set Location
+def cmd_set_location(cmd, buf, i, indiclient, logger):
+    data = buf[i : i + 8]
+    i += 8
+    lat = data[0] + (data[1] / 60) + (data[2] / 3600)
+    if data[3] == 1:
+        lat = -lat
+    long = data[4] + (data[5] / 60) + (data[6] / 3600)
+    if data[7] == 1:
+        long = 360.0 - long
+    p = getNumberWithRetry("GEOGRAPHIC_COORD")
+    if p is None:
+        return i, reply_error
+    p[0].value = lat
+    p[1].value = long
+    indiclient.sendNewNumber(p)
+    return i, b"#"
+
+
+# Goto/Sync
+def cmd_goto_sync(cmd, buf, i, indiclient, logger):
+    ingoto = cmd in GOTO_CMDS
+    if cmd in PRECISE_CMDS:
+        rahour = int(buf[i : i + 8], 16) * HOURS_PER_32BITS
+        decdeg = int(buf[i + 9 : i + 17], 16) * DEGREES_PER_32BITS
+        i += 17
+    else:
+        rahour = int(buf[i : i + 4], 16) * HOURS_PER_16BITS
+        decdeg = int(buf[i + 5 : i + 9], 16) * DEGREES_PER_16BITS
+        i += 9
+    if decdeg >= 270.0:  # I don't check for 90.0 < values < 270.0
+        decdeg = decdeg - 360.0
+    p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
+    if p is None:
+        return i, reply_error
+    p[0].value = rahour
+    p[1].value = decdeg
+    pcs = getSwitchWithRetry("ON_COORD_SET")
+    if pcs is None:
+        return i, reply_error
+    # Only resend the coord set mode when it changes: consecutive gotos
+    # (or syncs) then cost a single property update
+    oncoordset = PyIndi.ISS_ON if ingoto else PyIndi.ISS_OFF
+    if pcs[0].getState() != oncoordset or pcs[2].getState() == oncoordset:
+        pcs[0].setState(oncoordset)
+        pcs[1].setState(PyIndi.ISS_OFF)
+        pcs[2].setState(PyIndi.ISS_OFF if ingoto else PyIndi.ISS_ON)
+        indiclient.sendNewSwitch(pcs)
+    if ingoto:
+        logger.info("Goto %s, %s", rahour, decdeg)
+    else:
+        logger.info("Sync %s, %s", rahour, decdeg)
+    indiclient.sendNewNumber(p)
+    return i, b"#"
+
+
+# in goto ?
+def cmd_in_goto(cmd, buf, i, indiclient, logger):
+    p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
+    if p is None:
+        return i, reply_error
+    if p.getState() == PyIndi.IPS_BUSY:
+        return i, b"1#"
+    return i, b"0#"
+
+
+# abort goto
+def cmd_abort_goto(cmd, buf, i, indiclient, logger):
+    p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
+    if p is None:
+        return i, reply_error
+    if p.getState() == PyIndi.IPS_BUSY:
+        p = getSwitchWithRetry("TELESCOPE_ABORT_MOTION")
+        if p is None:
+            return i, reply_error
+        p[0].setState(PyIndi.ISS_ON)
+        indiclient.sendNewSwitch(p)
+    return i, b"#"
+
+
+# MoveWE/MoveNS
+def cmd_move(cmd, buf, i, indiclient, logger):
+    data = buf[i : i + 7]
+    i += 7
+    if data[0] != 2:  # variable rate not supported
+        return i, reply_error
+    if data[1] == 16:
+        pmotionname = "TELESCOPE_MOTION_WE"
+    else:  # should be 17
+        pmotionname = "TELESCOPE_MOTION_NS"
+    pmotion = getSwitchWithRetry(pmotionname)
+    if pmotion is None:
+        return i, reply_error
+    rate = data[3]
+    if rate == 0:  # stop
+        pmotion[0].setState(PyIndi.ISS_OFF)
+        pmotion[1].setState(PyIndi.ISS_OFF)
+        indiclient.sendNewSwitch(pmotion)
+    else:
+        prate = getSwitchWithRetry("TELESCOPE_SLEW_RATE")
+        if prate is None or len(prate) < 1:  # no slew rate
+            return i, reply_error
+        # the last switch is the fastest rate, used for unknown rates
+        prateset = prate[len(prate) - 1]
+        if rate < len(SLEW_RATE_NAMES):
+            name = SLEW_RATE_NAMES[rate]
+            for p in prate:
+                if p.getName() == name:
+                    prateset = p
+                    break
+        # slew rate is a one of many switch: only send it when it changes
+        if prateset.getState() != PyIndi.ISS_ON:
+            for p in prate:
+                p.setState(PyIndi.ISS_OFF)
+            prateset.setState(PyIndi.ISS_ON)
+            indiclient.sendNewSwitch(prate)
+        movedir = data[2]
+        if movedir == 36:  # positive move i.e. West/North
+            pmotion[0].setState(PyIndi.ISS_ON)
+            pmotion[1].setState(PyIndi.ISS_OFF)
+        else:  # should be 37 negative move i.e. East/South
+            pmotion[0].setState(PyIndi.ISS_OFF)
+            pmotion[1].setState(PyIndi.ISS_ON)
+        indiclient.sendNewSwitch(pmotion)
+    return i, b"#"
+
+
+# Pierside
+def cmd_get_pierside(cmd, buf, i, indiclient, logger):
+    p = getSwitchWithRetry("TELESCOPE_PIER_SIDE")
+    if p is None:
+        return i, reply_error
+    if p[0].getState() == PyIndi.ISS_ON:  # PIER_EAST
+        return i, b"E#"
+    return i, b"W#"
+
+
+# Tracking is on when any of the track rate switches is on
+def tracking_enabled(p):
+    return any(sw.getState() == PyIndi.ISS_ON for sw in p)
+
+
+# Get Tracking
+def cmd_get_tracking(cmd, buf, i, indiclient, logger):
+    p = getSwitchWithRetry("TELESCOPE_TRACK_RATE")
+    if p is None:
+        return i, reply_error
+    if tracking_enabled(p):
+        return i, b"2#"
+    return i, b"0#"
+
+
+# Set Tracking
+def cmd_set_tracking(cmd, buf, i, indiclient, logger):
+    mode = buf[i]
+    i += 1
+    p = getSwitchWithRetry("TELESCOPE_TRACK_RATE")
+    if p is None:
+        return i, reply_error
+    if mode in EQ_TRACKING_MODES:  # EQ/PEC tracking (no Alt/Az)
+        if p[0].getState() == PyIndi.ISS_OFF:
+            for sw in p:
+                sw.setState(PyIndi.ISS_OFF)
+            p[0].setState(PyIndi.ISS_ON)
+            indiclient.sendNewSwitch(p)
+    else:
+        if tracking_enabled(p):
+            for sw in p:
+                sw.setState(PyIndi.ISS_OFF)
+            indiclient.sendNewSwitch(p)
+    return i, b"#"
+
+
+# Command byte -> (handler, needs a connected device)
+COMMANDS = {
+    ord(b"\x00"): (cmd_jump, False),
+    ord("#"): (cmd_terminator, False),
+    ord("K"): (cmd_echo, False),
+    ord("J"): (cmd_alignment_complete, True),
+    ord("e"): (cmd_get_radec, True),
+    ord("E"): (cmd_get_radec, True),
+    ord("h"): (cmd_get_time, True),
+    ord("m"): (cmd_get_model, True),
+    ord("w"): (cmd_get_location, True),
+    ord("V"): (cmd_get_version, True),
+    ord("H"): (cmd_set_time, True),
+    ord("W"): (cmd_set_location, True),
+    ord("r"): (cmd_goto_sync, True),
+    ord("R"): (cmd_goto_sync, True),
+    ord("s"): (cmd_goto_sync, True),
+    ord("S"): (cmd_goto_sync, True),
+    ord("L"): (cmd_in_goto, True),
+    ord("M"): (cmd_abort_goto, True),
+    ord("P"): (cmd_move, True),
+    ord("p"): (cmd_get_pierside, True),
+    ord("t"): (cmd_get_tracking, True),
+    ord("T"): (cmd_set_tracking, True),
+}
 
 
 def process_command(buf, indiclient, logger):
     global device
-    # Default error
-    reply_error = b"#"
     i = 0
-    reply = b""
+    replies = []
     while i < len(buf):
         cmd = buf[i]
         i += 1
-        # Jump
-        if cmd == ord(b"\x00"):
-            pass
-        elif cmd == ord("#"):
-            reply += b"#"
-        # Echo
-        elif cmd == ord("K"):
-            if not (indiclient.isconnected):
-                reply += reply_error
-            else:
-                reply += buf[i : i + 1] + b"#"
+        handler, needsdevice = COMMANDS.get(cmd, (None, True))
+        if needsdevice and (
+            not (device) or not (indiclient.isconnected) or not (device.isConnected())
+        ):
+            logger.info("Lost device %s: cannot process command", TELESCOPE_DEVICE)
+            replies.append(reply_error)
+            break
+        if handler is None:  # unknown
+            replies.append(reply_error)
             i += 1
-        elif not (device) or not (indiclient.isconnected) or not (device.isConnected()):
-            logger.info("Lost device " + TELESCOPE_DEVICE + ": cannot process command")
-            return reply + reply_error
-        # Alignment complete ?
-        elif cmd == ord("J"):
-            reply += b"\x01" + b"#"
-        # Get Ra/Dec
-        elif cmd in [ord("e"), ord("E")]:
-            p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
-            if p is None:
-                reply += reply_error
-                continue
-            radeg = (p[0].value * 360.0) / 24.0
-            decdeg = p[1].value
-            if decdeg < 0.0:
-                decdeg = 360.0 + decdeg
-            rahex = hex(int((radeg * 2**24) / 360.0))[2:].zfill(6).upper() + "00"
-            dechex = hex(int((decdeg * 2**24) / 360.0))[2:].zfill(6).upper() + "00"
-            if sys.version_info >= (3,):
-                rahex = bytes(rahex, "ascii")
-                dechex = bytes(dechex, "ascii")
-            if cmd == ord("e"):
-                reply += rahex + b"," + dechex + b"#"
-            else:
-                reply += rahex[0:4] + b"," + dechex[0:4] + b"#"
-        # Get time
-        elif cmd == ord("h"):
-            p = getTextWithRetry("TIME_UTC")
-            if p is None:
-                reply += reply_error
-                continue
-            utc8601 = p[0].text
-            if p[1].text:
-                offset = int(p[1].text)
-            else:
-                offset = 0
-            # could use dateutil.parser.parse
-            utc = datetime.datetime.strptime(utc8601, "%Y-%m-%dT%H:%M:%S")
-            utc = utc + datetime.timedelta(0, 0, 0, 0, 0, offset)
-            if offset < 0:
-                offset = 256 - offset
-            reply += (
-                struct.pack(
-                    "BBBBBBBB",
-                    utc.hour,
-                    utc.minute,
-                    utc.second,
-                    utc.month,
-                    utc.day,
-                    utc.year - 2000,
-                    offset,
-                    0x00,
-                )
-                + b"#"
-            )
-        # Get Model
-        elif cmd == ord("m"):
-            p = getTextWithRetry("MOUNTINFORMATION")
-            if p is None:
-                m = b"!"
-            else:
-                skywatcher_models = {
-                    "EQ6": b"\x00",
-                    "HEQ5": b"\x01",
-                    "EQ5": b"\x02",
-                    "EQ3": b"\x03",
-                    "EQ8": b"\x04",
-                    "AZ-EQ6": b"\x05",
-                    "AZ-EQ5": b"\x06",
-                }
-                if p[0].text in skywatcher_models:
-                    m = skywatcher_models[p[0].text]
-                else:
-                    m = b"\x00"
-            reply += m + b"#"
-        # Get Location
-        elif cmd == ord("w"):
-            p = getNumberWithRetry("GEOGRAPHIC_COORD")
-            if p is None:
-                reply += reply_error
-                continue
-            latdeg = p[0].value
-            longdeg = p[1].value
-            elev = p[2].value
-            latd = b"\x00"
-            if latdeg < 0.0:
-                latd = b"\x01"
-                latdeg = -(latdeg)
-            latfrac, lata = math.modf(latdeg)
-            latfrac, latb = math.modf(latfrac * 60)
-            latfrac, latc = math.modf(latfrac * 60)
-            longh = b"\x00"
-            if longdeg > 180.0:
-                longdeg -= 360.0
-            if longdeg < 0.0:
-                longh = b"\x01"
-                longdeg = -(longdeg)
-            longfrac, longe = math.modf(longdeg)
-            longfrac, longf = math.modf(longfrac * 60)
-            longfrac, longg = math.modf(longfrac * 60)
-            reply += (
-                struct.pack("BBB", int(lata), int(latb), int(latc))
-                + latd
-                + struct.pack("BBB", int(longe), int(longf), int(longg))
-                + longh
-                + b"#"
-            )
-        # Get Version
-        elif cmd == ord("V"):
-            # reply += b"21#"
-            # reply += b"\x04\x0E#"
-            # reply += b"\x03\x03#"
-            # nex skywatcher ?
-            # reply += b"042508#"
-            reply += b"032507"
-            # celestron / old skywatcher ?
-            # reply += b"\x04\x25\x07"
-            # reply += b"\x04\x25\x07#" normally with a # but this corrupts the indi-synscan driver
-        # Set time
-        elif cmd == ord("H"):
-            [h, m, s, mth, d, y, offset, dst] = buf[i : i + 8]
-            i += 8
-            y += 2000
-            if offset < 0:
-                offset = 256 - offset
-            lt = datetime.datetime(y, mth, d, h, m, s, 0, None)
-            utc = lt - datetime.timedelta(0, 0, 0, 0, 0, offset)
-            logger.info("Setting time to " + utc.isoformat() + " " + str(offset))
-            p = getTextWithRetry("TIME_UTC")
-            if p is None:
-                reply += reply_error
-                continue
-            p[0].text = utc.isoformat()
-            p[1].text = str(offset)
-            indiclient.sendNewText(p)
-            reply += b"#"
-        # Set Location
-        elif cmd == ord("W"):
-            data = buf[i : i + 8]
-            i += 8
-            lat = data[0] + (data[1] / 60) + (data[2] / 3600)
-            if data[3] == 1:
-                lat = -lat
-            long = data[4] + (data[5] / 60) + (data[6] / 3600)
-            if data[7] == 1:
-                long = 360.0 - long
-            p = getNumberWithRetry("GEOGRAPHIC_COORD")
-            if p is None:
-                reply += reply_error
-                continue
-            p[0].value = lat
-            p[1].value = long
-            indiclient.sendNewNumber(p)
-            reply += b"#"
-        # Goto/Sync
-        elif cmd in [ord("r"), ord("R"), ord("s"), ord("S")]:
-            ingoto = cmd in [ord("r"), ord("R")]
-            if cmd in [ord("r"), ord("s")]:
-                rahour = (int(buf[i : i + 8], 16) * 24.0) / (2**32)
-                decdeg = (int(buf[i + 9 : i + 17], 16) * 360.0) / (2**32)
-                i += 17
-            else:
-                rahour = (int(buf[i : i + 4], 16) * 24.0) / (2**16)
-                decdeg = (int(buf[i + 5 : i + 9], 16) * 360.0) / (2**16)
-                i += 9
-            if decdeg >= 270.0:  # I don't check for 90.0 < values < 270.0
-                decdeg = decdeg - 360.0
-            p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
-            if p is None:
-                reply += reply_error
-                continue
-            p[0].value = rahour
-            p[1].value = decdeg
-            pcs = getSwitchWithRetry("ON_COORD_SET")
-            if pcs is None:
-                reply += reply_error
-                continue
-            if ingoto:
-                pcs[0].setState(PyIndi.ISS_ON)
-                pcs[1].setState(PyIndi.ISS_OFF)
-                pcs[2].setState(PyIndi.ISS_OFF)
-                logger.info("Goto " + str(rahour) + ", " + str(decdeg))
-            else:
-                pcs[0].setState(PyIndi.ISS_OFF)
-                pcs[1].setState(PyIndi.ISS_OFF)
-                pcs[2].setState(PyIndi.ISS_ON)
-                logger.info("Sync " + str(rahour) + ", " + str(decdeg))
-            indiclient.sendNewSwitch(pcs)
-            indiclient.sendNewNumber(p)
-            reply += b"#"
-        # in goto ?
-        elif cmd == ord("L"):
-            p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
-            if p is None:
-                reply += reply_error
-                continue
-            if p.getState() == PyIndi.IPS_BUSY:
-                reply += b"1#"
-            else:
-                reply += b"0#"
-        # abort goto
-        elif cmd == ord("M"):
-            p = getNumberWithRetry("EQUATORIAL_EOD_COORD")
-            if p is None:
-                reply += reply_error
-                continue
-            if p.getState() == PyIndi.IPS_BUSY:
-                p = getSwitchWithRetry("TELESCOPE_ABORT_MOTION")
-                if p is None:
-                    reply += reply_error
-                    continue
-                p[0].setState(PyIndi.ISS_ON)
-                indiclient.sendNewSwitch(p)
-            reply += b"#"
-        # MoveWE/MoveNS
-        elif cmd == ord("P"):
-            data = buf[i : i + 7]
-            i += 7
-            if data[0] != 2:  # variable rate not supported
-                reply += reply_error
-                continue
-            if data[1] == 16:
-                pmotionname = "TELESCOPE_MOTION_WE"
-            else:  # should be 17
-                pmotionname = "TELESCOPE_MOTION_NS"
-            pmotion = getSwitchWithRetry(pmotionname)
-            if pmotion is None:
-                reply += reply_error
-                continue
-            rate = data[3]
-            if rate == 0:  # stop
-                pmotion[0].setState(PyIndi.ISS_OFF)
-                pmotion[1].setState(PyIndi.ISS_OFF)
-                indiclient.sendNewSwitch(pmotion)
-            else:
-                prate = getSwitchWithRetry("TELESCOPE_SLEW_RATE")
-                if prate is None or len(prate) < 1:  # no slew rate
-                    reply += reply_error
-                    continue
-                prateswitches = {
-                    "SLEW_GUIDE": None,
-                    "SLEW_CENTERING": None,
-                    "SLEW_FIND": None,
-                    "SLEW_MAX": None,
-                }
-                for p in prate:
-                    p.setState(PyIndi.ISS_OFF)
-                    if p.getName() in prateswitches:
-                        prateswitches[p.getName()] = p
-                prateset = prate[len(prate) - 1]
-                if rate == 1 and prateswitches["SLEW_GUIDE"]:
-                    prateset = prateswitches["SLEW_GUIDE"]
-                if 2 <= rate <= 4 and prateswitches["SLEW_CENTERING"]:
-                    prateset = prateswitches["SLEW_CENTERING"]
-                if 5 <= rate <= 7 and prateswitches["SLEW_FIND"]:
-                    prateset = prateswitches["SLEW_FIND"]
-                if 8 <= rate <= 9 and prateswitches["SLEW_MAX"]:
-                    prateset = prateswitches["SLEW_MAX"]
-                prateset.setState(PyIndi.ISS_ON)
-                indiclient.sendNewSwitch(prate)
-                movedir = data[2]
-                if movedir == 36:  # positive move i.e. West/North
-                    pmotion[0].setState(PyIndi.ISS_ON)
-                    pmotion[1].setState(PyIndi.ISS_OFF)
-                else:  # should be 37 negative move i.e. East/South
-                    pmotion[0].setState(PyIndi.ISS_OFF)
-                    pmotion[1].setState(PyIndi.ISS_ON)
-                indiclient.sendNewSwitch(pmotion)
-            reply += b"#"
-        # Pierside
-        elif cmd == ord("p"):
-            p = getSwitchWithRetry("TELESCOPE_PIER_SIDE")
-            if p is None:
-                reply += reply_error
-                continue
-            if p[0].getState() == PyIndi.ISS_ON:  # PIER_EAST
-                reply += b"E#"
-            else:
-                reply += b"W#"
-        # Get Tracking
-        elif cmd == ord("t"):
-            p = getSwitchWithRetry("TELESCOPE_TRACK_RATE")
-            if p is None:
-                reply += reply_error
-                continue
-            mode = b"0"
-            if any(p[n].getState() == PyIndi.ISS_ON for n in range(4)):
-                mode = b"2"
-            reply += mode + b"#"
-        # Set Tracking
-        elif cmd == ord("T"):
-            mode = buf[i]
-            i += 1
-            p = getSwitchWithRetry("TELESCOPE_TRACK_RATE")
-            if p is None:
-                reply += reply_error
-                continue
-            if mode in [ord("2"), ord("3")]:  # EQ/PEC tracking (no Alt/Az)
-                if p[0].getState() == PyIndi.ISS_OFF:
-                    p[0].setState(ON)
-                    p[1].setState(OFF)
-                    p[2].setState(OFF)
-                    p[3].setState(OFF)
-                    indiclient.sendNewSwitch(p)
-            else:
-                if any(p[n].getState() == PyIndi.ISS_ON for n in range(4)):
-                    p[0].setState(OFF)
-                    p[1].setState(OFF)
-                    p[2].setState(OFF)
-                    p[3].setState(OFF)
-                    indiclient.sendNewSwitch(p)
-            reply += b"#"
-        else:  # unknown
-            reply += reply_error
-            i += 1
-    return reply
+            continue
+        i, r = handler(cmd, buf, i, indiclient, logger)
+        replies.append(r)
+    return b"".join(replies)
 
 
 logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
@@ -483,56 +562,59 @@ device = None
 
 # Connect server and device before launching serial port listening
 # timeout is 2 secs in tty_read from the synscan driver
-logger.info(
-    "Connecting server " + indiclient.getHost() + ":" + str(indiclient.getPort())
-)
-serverconnected = indiclient.connectServer()
-while not (serverconnected):
+logger.info("Connecting server %s:%d", indiclient.getHost(), indiclient.getPort())
+# retry with an exponential backoff (0.2s up to 5s)
+delay = 0.2
+while not (indiclient.connectServer()):
     logger.info(
-        "No indiserver running on "
-        + indiclient.getHost()
-        + ":"
-        + str(indiclient.getPort())
+        "No indiserver running on %s:%d", indiclient.getHost(), indiclient.getPort()
     )
-    time.sleep(2)
-    serverconnected = indiclient.connectServer()
-if not (device):
+    time.sleep(delay)
+    delay = min(delay * 2, 5.0)
+while True:
+    deviceUpdated.clear()
     device = indiclient.getDevice(TELESCOPE_DEVICE)
-    while not (device):
-        logger.info("Trying to get device " + TELESCOPE_DEVICE)
-        time.sleep(0.5)
-        device = indiclient.getDevice(TELESCOPE_DEVICE)
-logger.info("Got device " + TELESCOPE_DEVICE)
+    if device:
+        break
+    logger.info("Trying to get device %s", TELESCOPE_DEVICE)
+    deviceUpdated.wait(0.5)
+logger.info("Got device %s", TELESCOPE_DEVICE)
 
 if not (device.isConnected()):
     if TELESCOPE_SIMULATION:
-        logger.info("setting " + TELESCOPE_SIMPROP + " On")
-        device_sim = device.getSwitch(TELESCOPE_SIMPROP)
-        while not (device_sim):
-            logger.info("Trying to get poperty " + TELESCOPE_SIMPROP)
-            time.sleep(0.5)
+        logger.info("setting %s On", TELESCOPE_SIMPROP)
+        while True:
+            deviceUpdated.clear()
             device_sim = device.getSwitch(TELESCOPE_SIMPROP)
+            if device_sim:
+                break
+            logger.info("Trying to get poperty %s", TELESCOPE_SIMPROP)
+            deviceUpdated.wait(0.5)
 
         device_sim[0].setState(PyIndi.ISS_ON)  # the "ENABLE" switch
         device_sim[1].setState(PyIndi.ISS_OFF)  # the "DISABLE" switch
         indiclient.sendNewSwitch(device_sim)
 
 if not (device.isConnected()):
-    device_connect = device.getSwitch("CONNECTION")
-    while not (device_connect):
-        logger.info("Trying to connect device " + TELESCOPE_DEVICE)
-        time.sleep(0.5)
+    while True:
+        deviceUpdated.clear()
         device_connect = device.getSwitch("CONNECTION")
+        if device_connect:
+            break
+        logger.info("Trying to connect device %s", TELESCOPE_DEVICE)
+        deviceUpdated.wait(0.5)
 if not (device.isConnected()):
     device_connect[0].setState(PyIndi.ISS_ON)  # the "CONNECT" switch
     device_connect[1].setState(PyIndi.ISS_OFF)  # the "DISCONNECT" switch
+    deviceUpdated.clear()
     indiclient.sendNewSwitch(device_connect)
 while not (device.isConnected()):
-    time.sleep(0.2)
-logger.info("Device " + TELESCOPE_DEVICE + " connected")
+    deviceUpdated.wait(0.2)
+    deviceUpdated.clear()
+logger.info("Device %s connected", TELESCOPE_DEVICE)
 
 if USE_SERIAL:
-    logger.info("Creating virtual serial port " + DEVICE_PORT)
+    logger.info("Creating virtual serial port %s", DEVICE_PORT)
     # create the virtual serial port
     master, slave = pty.openpty()
     # and link it to /tmp/indi-synscan
@@ -543,70 +625,97 @@ if USE_TCP:
     server_name = "0.0.0.0"
     server_port = TCP_LISTEN_PORT
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # allow restarting the bridge while old connections are in TIME_WAIT
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_address = (server_name, server_port)
-    logger.info(
-        "Starting up on {0} port {1}\n".format(server_address[0], server_address[1])
-    )
+    logger.info("Starting up on %s port %d", server_address[0], server_address[1])
     sock.bind(server_address)
-    sock.listen(1)
+    sock.listen(5)
 
-rlist = [master, sock]
-wlist = []
-xlist = [master, sock]
+# file descriptors are registered once, the selector uses epoll on Linux
+selector = selectors.DefaultSelector()
+if USE_SERIAL:
+    selector.register(master, selectors.EVENT_READ)
+if USE_TCP:
+    selector.register(sock, selectors.EVENT_READ)
+# signals are written to this socket pair so that they wake up the selector,
+# whichever thread received them: no select timeout is needed to catch ctrl-C
+wakeupRecv, wakeupSend = socket.socketpair()
+wakeupRecv.setblocking(False)
+wakeupSend.setblocking(False)
+signal.set_wakeup_fd(wakeupSend.fileno())
+selector.register(wakeupRecv, selectors.EVENT_READ)
 
 try:
     while True:
-        rready, wready, eready = select.select(
-            rlist, wlist, xlist, 1
-        )  # timeout 1 sec to catch ctrl-C
-        for f in rready:
-            if f == master:
+        events = selector.select()
+        for key, mask in events:
+            f = key.fileobj
+            if f is wakeupRecv:
+                # the KeyboardInterrupt is raised by the python signal handler
+                wakeupRecv.recv(64)
+                continue
+            if USE_SERIAL and f == master:
                 # serial
                 chars = os.read(master, 1024)
-                if sys.version_info < (3,):
-                    chars = bytearray(chars)
                 # while chars!=b'':
-                logger.info("read: " + repr(chars))
+                logger.info("read: %r", chars)
                 reply = process_command(chars, indiclient, logger)
-                # logger.info("write: "+ repr(reply))
-                for c in reply.split(b"#")[:-1]:
-                    logger.info("write: " + repr(c + b"#"))
-                    os.write(master, c + b"#")
-                    # chars=os.read(master, 1024)
-                    # if sys.version_info < (3,):
-                    #    chars=bytearray(chars)
-            if f == sock:
+                # replies are already terminated: send them in a single write
+                if reply != b"":
+                    logger.info("write: %r", reply)
+                    os.write(master, reply)
+            if USE_TCP and f is sock:
                 # SkySafari v4.0.1 continously opens and closed the connection,
                 # while Stellarium via socat opens it and keeps it open using:
                 # $ ./socat GOPEN:/dev/ptyp0,ignoreeof TCP:raspberrypi8:4030
                 # (probably socat which is maintaining the link)
                 # sys.stdout.write("waiting for a connection\n")
                 connection, client_address = sock.accept()
-                chars = ""
+                # replies are tiny and answer a poll: do not let Nagle delay them
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                # detect clients which vanished without closing the connection
+                connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # clients are served from this loop, along with the serial port
+                # and the other clients: their address is kept as selector data
+                selector.register(connection, selectors.EVENT_READ, client_address)
+                logger.info(
+                    "Client connected: %s, %s", client_address[0], client_address[1]
+                )
+            elif USE_TCP and key.data is not None:
+                # the selector reported data, recv won't block
                 try:
-                    logger.info(
-                        "Client connected: {0}, {1}".format(
-                            client_address[0], client_address[1]
-                        )
-                    )
-                    while True:
-                        chars = connection.recv(1024)
-                        if len(chars) == 0:
-                            break
-                        if sys.version_info < (3,):
-                            chars = bytearray(chars)
-                        logger.info("read: " + repr(chars))
-                        reply = process_command(chars, indiclient, logger)
-                        if reply != b"":
-                            connection.sendall(reply)
-                            logger.info("write: " + repr(reply))
-                        else:
-                            logger.info("nothing to respond")
-                finally:
-                    connection.close()
+                    chars = f.recv(1024)
+                except OSError:
+                    chars = b""
+                if len(chars) == 0:
+                    selector.unregister(f)
+                    f.close()
+                    logger.info("Client disconnected: %s, %s", key.data[0], key.data[1])
+                    continue
+                logger.info("read: %r", chars)
+                reply = process_command(chars, indiclient, logger)
+                if reply != b"":
+                    logger.info("write: %r", reply)
+                    try:
+                        f.sendall(reply)
+                    except OSError:
+                        selector.unregister(f)
+                        f.close()
+                        logger.info("Client lost: %s, %s", key.data[0], key.data[1])
+                else:
+                    logger.info("nothing to respond")
 
 except KeyboardInterrupt:
     logger.info("pyindi-synscan stopped (Ctrl-C)")
 
+for key in list(selector.get_map().values()):
+    if key.data is not None:
+        key.fileobj.close()
+selector.close()
+signal.set_wakeup_fd(-1)
+wakeupRecv.close()
+wakeupSend.close()
+
 if USE_SERIAL:
     os.remove(DEVICE_PORT)
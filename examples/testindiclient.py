@@ -8,22 +8,14 @@ import PyIndi
 
 # Fancy printing of INDI states
 # Note that all INDI constants are accessible from the module as PyIndi.CONSTANTNAME
-def strISState(s):
-    if s == PyIndi.ISS_OFF:
-        return "Off"
-    else:
-        return "On"
+strISState = {PyIndi.ISS_OFF: "Off", PyIndi.ISS_ON: "On"}
 
-
-def strIPState(s):
-    if s == PyIndi.IPS_IDLE:
-        return "Idle"
-    elif s == PyIndi.IPS_OK:
-        return "Ok"
-    elif s == PyIndi.IPS_BUSY:
-        return "Busy"
-    elif s == PyIndi.IPS_ALERT:
-        return "Alert"
+strIPState = {
+    PyIndi.IPS_IDLE: "Idle",
+    PyIndi.IPS_OK: "Ok",
+    PyIndi.IPS_BUSY: "Busy",
+    PyIndi.IPS_ALERT: "Alert",
+}
 
 
 # The IndiClient class which inherits from the module PyIndi.BaseClient class
@@ -35,50 +27,45 @@ class IndiClient(PyIndi.BaseClient):
         self.logger.info("creating an instance of IndiClient")
 
     def newDevice(self, d):
-        self.logger.info("new device " + d.getDeviceName())
+        self.logger.info("new device %s", d.getDeviceName())
 
     def newProperty(self, p):
         self.logger.info(
-            "new property " + p.getName() + " for device " + p.getDeviceName()
+            "new property %s for device %s", p.getName(), p.getDeviceName()
         )
 
     def removeProperty(self, p):
         self.logger.info(
-            "remove property " + p.getName() + " for device " + p.getDeviceName()
+            "remove property %s for device %s", p.getName(), p.getDeviceName()
         )
 
     def newBLOB(self, bp):
-        self.logger.info("new BLOB " + bp.name.decode())
+        self.logger.info("new BLOB %s", bp.name.decode())
 
     def newSwitch(self, svp):
-        self.logger.info("new Switch " + svp.name + " for device " + svp.device)
+        self.logger.info("new Switch %s for device %s", svp.name, svp.device)
 
     def newNumber(self, nvp):
-        self.logger.info("new Number " + nvp.name + " for device " + nvp.device)
+        self.logger.info("new Number %s for device %s", nvp.name, nvp.device)
 
     def newText(self, tvp):
-        self.logger.info("new Text " + tvp.name + " for device " + tvp.device)
+        self.logger.info("new Text %s for device %s", tvp.name, tvp.device)
 
     def newLight(self, lvp):
-        self.logger.info("new Light " + lvp.name + " for device " + lvp.device)
+        self.logger.info("new Light %s for device %s", lvp.name, lvp.device)
 
     def newMessage(self, d, m):
-        self.logger.info("new Message " + d.messageQueue(m))
+        self.logger.info("new Message %s", d.messageQueue(m))
 
     def serverConnected(self):
-        self.logger.info(
-            "Server connected (" + self.getHost() + ":" + str(self.getPort()) + ")"
-        )
+        self.logger.info("Server connected (%s:%d)", self.getHost(), self.getPort())
 
     def serverDisconnected(self, code):
         self.logger.info(
-            "Server disconnected (exit code = "
-            + str(code)
-            + ","
-            + str(self.getHost())
-            + ":"
-            + str(self.getPort())
-            + ")"
+            "Server disconnected (exit code = %s,%s:%d)",
+            code,
+            self.getHost(),
+            self.getPort(),
         )
 
 
@@ -88,6 +75,11 @@ logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
 indiclient = IndiClient()
 indiclient.setServer("localhost", 7624)
 
+# Device names given on the command line restrict the listing to these devices:
+# the server then only sends us their properties. Without any, all devices are listed.
+for devicename in sys.argv[1:]:
+    indiclient.watchDevice(devicename)
+
 # Connect to server
 print("Connecting and waiting 1 sec")
 if not (indiclient.connectServer()):
@@ -102,49 +94,44 @@ if not (indiclient.connectServer()):
     sys.exit(1)
 time.sleep(1)
 
-# Print list of devices. The list is obtained from the wrapper function getDevices as indiclient is an instance
+# Get the list of devices. The list is obtained from the wrapper function getDevices as indiclient is an instance
 # of PyIndi.BaseClient and the original C++ array is mapped to a Python List. Each device in this list is an
 # instance of PyIndi.BaseDevice, so we use getDeviceName to print its actual name.
-print("List of devices")
 dl = indiclient.getDevices()
-for dev in dl:
-    print(dev.getDeviceName())
 
-# Print all properties and their associated values.
-print("List of Device Properties")
+# For each property type, how to get its vector of elements and how to print an element value
+propertyFormatters = {
+    PyIndi.INDI_TEXT: (lambda p: p.getText(), lambda t: t.text),
+    PyIndi.INDI_NUMBER: (lambda p: p.getNumber(), lambda t: str(t.value)),
+    PyIndi.INDI_SWITCH: (lambda p: p.getSwitch(), lambda t: strISState.get(t.s, "On")),
+    PyIndi.INDI_LIGHT: (
+        lambda p: p.getLight(),
+        lambda t: strIPState.get(t.s, str(t.s)),
+    ),
+    PyIndi.INDI_BLOB: (
+        lambda p: p.getBLOB(),
+        lambda t: "<blob " + str(t.size) + " bytes>",
+    ),
+}
+
+# Print the device names, then all properties and their associated values.
+# Devices are walked once: device names and property lines are collected
+# and written at once rather than with one print per value
+names = ["List of devices"]
+lines = ["List of Device Properties"]
 for d in dl:
-    print("-- " + d.getDeviceName())
+    names.append(d.getDeviceName())
+    lines.append("-- " + d.getDeviceName())
     lp = d.getProperties()
     for p in lp:
-        print("   > " + p.getName())
-        if p.getType() == PyIndi.INDI_TEXT:
-            tpy = p.getText()
-            for t in tpy:
-                print("       " + t.name + "(" + t.label + ")= " + t.text)
-        elif p.getType() == PyIndi.INDI_NUMBER:
-            tpy = p.getNumber()
-            for t in tpy:
-                print("       " + t.name + "(" + t.label + ")= " + str(t.value))
-        elif p.getType() == PyIndi.INDI_SWITCH:
-            tpy = p.getSwitch()
-            for t in tpy:
-                print("       " + t.name + "(" + t.label + ")= " + strISState(t.s))
-        elif p.getType() == PyIndi.INDI_LIGHT:
-            tpy = p.getLight()
-            for t in tpy:
-                print("       " + t.name + "(" + t.label + ")= " + strIPState(t.s))
-        elif p.getType() == PyIndi.INDI_BLOB:
-            tpy = p.getBLOB()
-            for t in tpy:
-                print(
-                    "       "
-                    + t.name
-                    + "("
-                    + t.label
-                    + ")= <blob "
-                    + str(t.size)
-                    + " bytes>"
-                )
+        lines.append("   > " + p.getName())
+        formatter = propertyFormatters.get(p.getType())
+        if formatter is None:
+            continue
+        getvector, strvalue = formatter
+        for t in getvector(p):
+            lines.append("       " + t.name + "(" + t.label + ")= " + strvalue(t))
+sys.stdout.write("\n".join(names) + "\n" + "\n".join(lines) + "\n")
 
 # Disconnect from the indiserver
 print("Disconnecting")
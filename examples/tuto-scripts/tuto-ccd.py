@@ -2,6 +2,7 @@ import PyIndi
 import time
 import sys
 import threading
+import queue
 
 
 class IndiClient(PyIndi.BaseClient):
@@ -9,19 +10,20 @@ class IndiClient(PyIndi.BaseClient):
         super(IndiClient, self).__init__()
 
     def newDevice(self, d):
-        pass
+        definitionEvent.set()
 
     def newProperty(self, p):
-        pass
+        definitionEvent.set()
 
     def removeProperty(self, p):
         pass
 
     def newBLOB(self, bp):
-        global blobEvent
         print("new BLOB ", bp.name)
-        blobEvent.set()
-        pass
+        # pyindi-client adds a getblobdata() method to IBLOB item
+        # for accessing the contents of the blob, which is a bytearray in Python.
+        # The contents are copied here so that the next exposure can't overwrite them
+        blobQueue.put((bp.name, bp.size, bp.format, bp.getblobdata()))
 
     def newSwitch(self, svp):
         pass
@@ -45,10 +47,32 @@ class IndiClient(PyIndi.BaseClient):
         pass
 
 
+# we use the threading.Event facility of Python to be woken up
+# as soon as the server defines a new device or property
+definitionEvent = threading.Event()
+
+
+# wait until getter(name) returns the device or property we ask for
+def waitDefinition(getter, name):
+    while True:
+        definitionEvent.clear()
+        result = getter(name)
+        if result:
+            return result
+        definitionEvent.wait(0.5)
+
+
 # connect the server
 indiclient = IndiClient()
 indiclient.setServer("localhost", 7624)
 
+# we are only interested in the telescope and ccd devices:
+# the server won't send us the properties of the other ones
+telescope = "Telescope Simulator"
+ccd = "CCD Simulator"
+indiclient.watchDevice(telescope)
+indiclient.watchDevice(ccd)
+
 if not (indiclient.connectServer()):
     print(
         "No indiserver running on "
@@ -61,21 +85,14 @@ if not (indiclient.connectServer()):
     sys.exit(1)
 
 # connect the scope
-telescope = "Telescope Simulator"
 device_telescope = None
 telescope_connect = None
 
 # get the telescope device
-device_telescope = indiclient.getDevice(telescope)
-while not (device_telescope):
-    time.sleep(0.5)
-    device_telescope = indiclient.getDevice(telescope)
+device_telescope = waitDefinition(indiclient.getDevice, telescope)
 
 # wait CONNECTION property be defined for telescope
-telescope_connect = device_telescope.getSwitch("CONNECTION")
-while not (telescope_connect):
-    time.sleep(0.5)
-    telescope_connect = device_telescope.getSwitch("CONNECTION")
+telescope_connect = waitDefinition(device_telescope.getSwitch, "CONNECTION")
 
 # if the telescope device is not connected, we do connect it
 if not (device_telescope.isConnected()):
@@ -92,10 +109,7 @@ vega = {"ra": (279.23473479 * 24.0) / 360.0, "dec": +38.78368896}
 
 # We want to set the ON_COORD_SET switch to engage tracking after goto
 # device.getSwitch is a helper to retrieve a property vector
-telescope_on_coord_set = device_telescope.getSwitch("ON_COORD_SET")
-while not (telescope_on_coord_set):
-    time.sleep(0.5)
-    telescope_on_coord_set = device_telescope.getSwitch("ON_COORD_SET")
+telescope_on_coord_set = waitDefinition(device_telescope.getSwitch, "ON_COORD_SET")
 # the order below is defined in the property vector, look at the standard Properties page
 # or enumerate them in the Python shell when you're developing your program
 telescope_on_coord_set[0].s = PyIndi.ISS_ON  # TRACK
@@ -103,10 +117,7 @@ telescope_on_coord_set[1].s = PyIndi.ISS_OFF  # SLEW
 telescope_on_coord_set[2].s = PyIndi.ISS_OFF  # SYNC
 indiclient.sendNewSwitch(telescope_on_coord_set)
 # We set the desired coordinates
-telescope_radec = device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-while not (telescope_radec):
-    time.sleep(0.5)
-    telescope_radec = device_telescope.getNumber("EQUATORIAL_EOD_COORD")
+telescope_radec = waitDefinition(device_telescope.getNumber, "EQUATORIAL_EOD_COORD")
 telescope_radec[0].value = vega["ra"]
 telescope_radec[1].value = vega["dec"]
 indiclient.sendNewNumber(telescope_radec)
@@ -116,32 +127,19 @@ while telescope_radec.s == PyIndi.IPS_BUSY:
     time.sleep(2)
 
 # Let's take some pictures
-ccd = "CCD Simulator"
-device_ccd = indiclient.getDevice(ccd)
-while not (device_ccd):
-    time.sleep(0.5)
-    device_ccd = indiclient.getDevice(ccd)
-
-ccd_connect = device_ccd.getSwitch("CONNECTION")
-while not (ccd_connect):
-    time.sleep(0.5)
-    ccd_connect = device_ccd.getSwitch("CONNECTION")
+device_ccd = waitDefinition(indiclient.getDevice, ccd)
+
+ccd_connect = waitDefinition(device_ccd.getSwitch, "CONNECTION")
 if not (device_ccd.isConnected()):
     ccd_connect[0].s = PyIndi.ISS_ON  # the "CONNECT" switch
     ccd_connect[1].s = PyIndi.ISS_OFF  # the "DISCONNECT" switch
     indiclient.sendNewSwitch(ccd_connect)
 
-ccd_exposure = device_ccd.getNumber("CCD_EXPOSURE")
-while not (ccd_exposure):
-    time.sleep(0.5)
-    ccd_exposure = device_ccd.getNumber("CCD_EXPOSURE")
+ccd_exposure = waitDefinition(device_ccd.getNumber, "CCD_EXPOSURE")
 
 # Ensure the CCD simulator snoops the telescope simulator
 # otherwise you may not have a picture of vega
-ccd_active_devices = device_ccd.getText("ACTIVE_DEVICES")
-while not (ccd_active_devices):
-    time.sleep(0.5)
-    ccd_active_devices = device_ccd.getText("ACTIVE_DEVICES")
+ccd_active_devices = waitDefinition(device_ccd.getText, "ACTIVE_DEVICES")
 ccd_active_devices[0].text = "Telescope Simulator"
 indiclient.sendNewText(ccd_active_devices)
 
@@ -149,37 +147,26 @@ indiclient.sendNewText(ccd_active_devices)
 # "CCD1" blob from this device
 indiclient.setBLOBMode(PyIndi.B_ALSO, ccd, "CCD1")
 
-ccd_ccd1 = device_ccd.getBLOB("CCD1")
-while not (ccd_ccd1):
-    time.sleep(0.5)
-    ccd_ccd1 = device_ccd.getBLOB("CCD1")
+# and wait for the blob property to be defined before exposing
+ccd_ccd1 = waitDefinition(device_ccd.getBLOB, "CCD1")
 
 # a list of our exposure times
 exposures = [1.0, 5.0]
 
-# we use here the threading.Event facility of Python
-# we define an event for newBlob event
-blobEvent = threading.Event()
-blobEvent.clear()
-i = 0
-ccd_exposure[0].value = exposures[i]
+# the client thread hands us the received blobs through a thread-safe queue
+blobQueue = queue.SimpleQueue()
+ccd_exposure[0].value = exposures[0]
 indiclient.sendNewNumber(ccd_exposure)
-while i < len(exposures):
+for i in range(len(exposures)):
     # wait for the ith exposure
-    blobEvent.wait()
+    name, size, blobformat, fits = blobQueue.get()
     # we can start immediately the next one
     if i + 1 < len(exposures):
         ccd_exposure[0].value = exposures[i + 1]
-        blobEvent.clear()
         indiclient.sendNewNumber(ccd_exposure)
     # and meanwhile process the received one
-    for blob in ccd_ccd1:
-        print("name: ", blob.name, " size: ", blob.size, " format: ", blob.format)
-        # pyindi-client adds a getblobdata() method to IBLOB item
-        # for accessing the contents of the blob, which is a bytearray in Python
-        fits = blob.getblobdata()
-        print("fits data type: ", type(fits))
-        # here you may use astropy.io.fits to access the fits data
-        # and perform some computations while the ccd is exposing
-        # but this is outside the scope of this tutorial
-    i += 1
+    print("name: ", name, " size: ", size, " format: ", blobformat)
+    print("fits data type: ", type(fits))
+    # here you may use astropy.io.fits to access the fits data
+    # and perform some computations while the ccd is exposing
+    # but this is outside the scope of this tutorial
@@ -1,4 +1,5 @@
 import PyIndi
+import threading
 
 
 class IndiClient(PyIndi.BaseClient):
@@ -43,5 +44,9 @@ indiclient = IndiClient()
 indiclient.setServer("localhost", 7624)
 
 indiclient.connectServer()
-while 1:
-    pass
+# The client callbacks run in their own thread: block the main thread
+# without using any CPU until the script is interrupted (Ctrl-C)
+try:
+    threading.Event().wait()
+except KeyboardInterrupt:
+    indiclient.disconnectServer()
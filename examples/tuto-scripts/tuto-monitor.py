@@ -1,5 +1,6 @@
 import PyIndi
-import time
+import queue
+import threading
 
 
 class IndiClient(PyIndi.BaseClient):
@@ -15,10 +16,13 @@ class IndiClient(PyIndi.BaseClient):
     def newProperty(self, p):
         global monitored
         global cmonitor
+        name = p.getName()
+        devicename = p.getDeviceName()
         # we catch the "CONNECTION" property of the monitored device
-        if p.getDeviceName() == monitored and p.getName() == "CONNECTION":
+        if devicename == monitored and name == "CONNECTION":
             cmonitor = p.getSwitch()
-        print("New property ", p.getName(), " for device ", p.getDeviceName())
+            cmonitorEvent.set()
+        print("New property ", name, " for device ", devicename)
 
     def removeProperty(self, p):
         pass
@@ -30,11 +34,9 @@ class IndiClient(PyIndi.BaseClient):
         pass
 
     def newNumber(self, nvp):
-        global newval
-        global prop
         # We only monitor Number properties of the monitored device
-        prop = nvp
-        newval = True
+        # they are handed to the main thread through a thread-safe queue
+        numberQueue.put(nvp)
 
     def newText(self, tvp):
         pass
@@ -55,6 +57,10 @@ class IndiClient(PyIndi.BaseClient):
 monitored = "Telescope Simulator"
 dmonitor = None
 cmonitor = None
+# set when the CONNECTION property is defined
+cmonitorEvent = threading.Event()
+# new values of number properties, filled by the client thread
+numberQueue = queue.Queue()
 
 indiclient = IndiClient()
 indiclient.setServer("localhost", 7624)
@@ -64,8 +70,7 @@ indiclient.watchDevice(monitored)
 indiclient.connectServer()
 
 # wait CONNECTION property be defined
-while not (cmonitor):
-    time.sleep(0.5)
+cmonitorEvent.wait()
 
 # if the monitored device is not connected, we do connect it
 if not (dmonitor.isConnected()):
@@ -76,16 +81,13 @@ if not (dmonitor.isConnected()):
     cmonitor[1].s = PyIndi.ISS_OFF  # the "DISCONNECT" switch
     indiclient.sendNewSwitch(cmonitor)  # send this new value to the device
 
-newval = False
-prop = None
 nrecv = 0
 while nrecv < 10:
-    # we poll the newval global variable
-    if newval:
-        print("newval for property", prop.name, " of device ", prop.device)
-        # prop is a property vector, mapped to an iterable Python object
-        for n in prop:
-            # n is a INumber as we only monitor number vectors
-            print(n.name, " = ", n.value)
-        nrecv += 1
-        newval = False
+    # we sleep until the client thread queues a new value
+    prop = numberQueue.get()
+    print("newval for property", prop.name, " of device ", prop.device)
+    # prop is a property vector, mapped to an iterable Python object
+    for n in prop:
+        # n is a INumber as we only monitor number vectors
+        print(n.name, " = ", n.value)
+    nrecv += 1
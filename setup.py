@@ -1,26 +1,19 @@
 """Setup file for packaging pyindi-client"""
 
+from os import environ
 from os.path import join, dirname, abspath, isfile
-from sys import exit
+from sys import exit, platform
 
-try:
-    from distutils.command.build import build
-    from setuptools.command.install import install
-    from setuptools import setup, Extension
-except:
-    from distutils.command.build import build
-    from distutils.command.install import install
-    from distutils import setup, Extension
+import sysconfig
+from setuptools import setup, Extension
+from setuptools.command.install import install
 
-march = ""
 try:
-    import sysconfig
-
-    march = sysconfig.get_config_var("MULTIARCH")
-except:
-    import sys
+    from setuptools.command.build import build
+except ImportError:  # setuptools < 62.4
+    from distutils.command.build import build
 
-    march = getattr(sys, "implementation", sys)._multiarch
+march = sysconfig.get_config_var("MULTIARCH") or ""
 
 ###
 
@@ -37,6 +30,8 @@ libindisearchpaths = [
     "/usr/local/lib/" + march,
     "/usr/local/lib",
 ]
+# without MULTIARCH the multiarch paths are their parent: don't stat it twice
+libindisearchpaths = list(dict.fromkeys(p.rstrip("/") for p in libindisearchpaths))
 
 libindipath = ""
 
@@ -51,12 +46,31 @@ if libindipath == "":
     print("Exiting")
     exit(1)
 
+# Opt-in: hide non exported symbols and drop the unreferenced wrapper and
+# libindiclient sections at link time. Set PYINDI_STRIP_SECTIONS=1 to enable.
+strip_compile_args = []
+strip_link_args = []
+if environ.get("PYINDI_STRIP_SECTIONS", "") == "1":
+    strip_compile_args = [
+        "-fvisibility=hidden",
+        "-ffunction-sections",
+        "-fdata-sections",
+    ]
+    if platform == "darwin":
+        strip_link_args = ["-Wl,-dead_strip"]
+    else:
+        strip_link_args = ["-Wl,--gc-sections", "-Wl,-O1"]
+
 pyindi_module = Extension(
     "_PyIndi",
     sources=["indiclientpython.i"],
     language="c++",
-    extra_compile_args=["-std=c++11"],
+    extra_compile_args=["-std=c++11", "-O3"] + strip_compile_args,
+    extra_link_args=strip_link_args,
     extra_objects=[join(libindipath, "libindiclient.a")],
+    # build_ext skips the extension, SWIG included, while it is newer than
+    # its sources: also rebuild it when libindi is upgraded
+    depends=[join(libindipath, "libindiclient.a")],
 )
 
 # Be sure to run build_ext in order to run swig prior to install/build
@@ -110,9 +124,10 @@ setup(
     cmdclass={"build": CustomBuild, "install": CustomInstall},
     ext_modules=[pyindi_module],
     py_modules=["PyIndi"],
+    # the SWIG module loads _PyIndi from the filesystem
+    zip_safe=False,
     classifiers=[
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2",
         "Programming Language :: Python :: 3",
         "Development Status :: 3 - Alpha",
         "Environment :: Other Environment",
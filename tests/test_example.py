@@ -1,14 +1,16 @@
 import PyIndi
 import pytest
+import threading
 import time
 
 
 class IndiClient(PyIndi.BaseClient):
     def __init__(self):
         super(IndiClient, self).__init__()
+        self.deviceDefined = threading.Event()
 
     def newDevice(self, d):
-        pass
+        self.deviceDefined.set()
 
     def newProperty(self, p):
         pass
@@ -41,19 +43,25 @@ class IndiClient(PyIndi.BaseClient):
         pass
 
 
-@pytest.fixture()
+# The tests only read from the server: share one connection between them
+@pytest.fixture(scope="module")
 def client():
     client = IndiClient()
     client.setServer("localhost", 7624)
     client.connectServer()
 
-    for _ in range(15):
-        if client.isServerConnected() and len(client.getDevices()) > 0:
+    # devices are defined one after the other: wait (up to 15 secs) until
+    # there are some and no new one shows up for half a second
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        client.deviceDefined.clear()
+        if not client.deviceDefined.wait(0.5) and len(client.getDevices()) > 0:
             break
-        time.sleep(1)
 
     yield client
 
+    client.disconnectServer()
+
 
 def test_connect(client):
     assert client.isServerConnected()
@@ -72,18 +80,20 @@ def test_list_devices(client):
     assert set(device_names) == set(expected_device_names)
 
 
+# Vector getter of each property type
+propertyGetters = {
+    PyIndi.INDI_TEXT: lambda p: p.getText(),
+    PyIndi.INDI_NUMBER: lambda p: p.getNumber(),
+    PyIndi.INDI_SWITCH: lambda p: p.getSwitch(),
+    PyIndi.INDI_LIGHT: lambda p: p.getLight(),
+    PyIndi.INDI_BLOB: lambda p: p.getBLOB(),
+}
+
+
 def test_getting_properties(client):
     for d in client.getDevices():
         for prop in d.getProperties():
             prop_name = prop.getName()
-            prop_type = prop.getType()
-            if prop_type == PyIndi.INDI_TEXT:
-                prop_text = prop.getText()
-            elif prop_type == PyIndi.INDI_NUMBER:
-                prop_number = prop.getNumber()
-            elif prop_type == PyIndi.INDI_SWITCH:
-                prop_switch = prop.getSwitch()
-            elif prop_type == PyIndi.INDI_LIGHT:
-                prop_light = prop.getLight()
-            elif prop_type == PyIndi.INDI_BLOB:
-                prop_blob = prop.getBLOB()
+            getter = propertyGetters.get(prop.getType())
+            if getter is not None:
+                prop_vector = getter(prop)